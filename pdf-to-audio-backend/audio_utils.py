@@ -4,14 +4,33 @@ Audio processing utilities for merging and manipulating audio files
 
 import asyncio
 import logging
+import os
+import shutil
 import tempfile
-import subprocess
+from fractions import Fraction
 from pathlib import Path
-from typing import List, Optional
-import os
+from typing import Dict, List, Optional, Tuple
+
+from config import settings
+
+try:
+    import av
+except ImportError:  # PyAV is optional, merging falls back to concatenation
+    av = None
 
 logger = logging.getLogger(__name__)
 
+# Buffer size for streaming audio between files
+COPY_BUFFER_SIZE = 1 << 20
+
+
+def _stat_or_none(path: Path) -> Optional[os.stat_result]:
+    """Stat a path with a single syscall, returning None if it doesn't exist"""
+    try:
+        return os.stat(path)
+    except FileNotFoundError:
+        return None
+
 
 class AudioProcessor:
     """Handle audio file processing and manipulation"""
@@ -20,6 +39,15 @@ class AudioProcessor:
         """Initialize audio processor"""
         self.temp_dir = Path(tempfile.gettempdir()) / "pdf_audio_temp"
         self.temp_dir.mkdir(exist_ok=True)
+        
+        # Probe for external tools once rather than on every call
+        self._has_ffprobe = shutil.which('ffprobe') is not None
+        
+        # Durations keyed by (path, size, mtime) so rewritten files are re-probed
+        self._duration_cache: Dict[Tuple[str, int, int], float] = {}
+        
+        # Byte rate of the TTS output, used to estimate durations without ffprobe
+        self._bytes_per_sec = settings.TTS_BITRATE_KBPS * 1024 / 8
     
     async def merge_audio_files(self, audio_files: List[Path], output_path: Path) -> bool:
         """
@@ -39,37 +67,24 @@ class AudioProcessor:
         if len(audio_files) == 1:
             # If only one file, just copy it
             try:
-                with open(audio_files[0], 'rb') as src, open(output_path, 'wb') as dst:
-                    dst.write(src.read())
+                # copyfile uses the kernel's zero-copy path where available
+                await asyncio.to_thread(shutil.copyfile, audio_files[0], output_path)
                 logger.info(f"Single audio file copied to {output_path}")
                 return True
             except Exception as e:
                 logger.error(f"Failed to copy single audio file: {str(e)}")
                 return False
         
-        # Check if ffmpeg is available
-        if await self._check_ffmpeg():
+        if av is not None:
             return await self._merge_with_ffmpeg(audio_files, output_path)
         else:
             # Fallback to simple concatenation
             return await self._simple_concatenate(audio_files, output_path)
     
-    async def _check_ffmpeg(self) -> bool:
-        """Check if ffmpeg is available"""
-        try:
-            result = await asyncio.create_subprocess_exec(
-                'ffmpeg', '-version',
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            await result.communicate()
-            return result.returncode == 0
-        except:
-            return False
-    
     async def _merge_with_ffmpeg(self, audio_files: List[Path], output_path: Path) -> bool:
         """
-        Merge audio files using ffmpeg (high quality)
+        Merge audio files in-process with the ffmpeg libraries via PyAV (high quality),
+        falling back to simple concatenation if PyAV can't process the inputs
         
         Args:
             audio_files: List of audio file paths
@@ -79,49 +94,57 @@ class AudioProcessor:
             True if successful
         """
         try:
-            # Create a temporary file list for ffmpeg
-            list_file = self.temp_dir / f"merge_list_{os.getpid()}.txt"
-            
-            with open(list_file, 'w') as f:
-                for audio_file in audio_files:
-                    if audio_file.exists():
-                        f.write(f"file '{audio_file.absolute()}'\n")
-            
-            # Use ffmpeg to concatenate
-            cmd = [
-                'ffmpeg',
-                '-f', 'concat',
-                '-safe', '0',
-                '-i', str(list_file),
-                '-c', 'copy',
-                '-y',  # Overwrite output file
-                str(output_path)
-            ]
-            
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            
-            stdout, stderr = await process.communicate()
-            
-            # Clean up temp file
-            try:
-                list_file.unlink()
-            except:
-                pass
-            
-            if process.returncode == 0:
-                logger.info(f"Successfully merged {len(audio_files)} files with ffmpeg")
-                return True
-            else:
-                logger.error(f"ffmpeg merge failed: {stderr.decode()}")
-                return False
+            # Demuxing and muxing block, so keep them off the event loop
+            await asyncio.to_thread(self._remux_audio_files, audio_files, output_path)
+            logger.info(f"Successfully merged {len(audio_files)} files with PyAV")
+            return True
                 
         except Exception as e:
-            logger.error(f"Error merging with ffmpeg: {str(e)}")
-            return False
+            # Inputs PyAV can't demux (e.g. the mock audio) can still be concatenated
+            logger.warning(f"PyAV merge failed, falling back to simple concatenation: {str(e)}")
+            output_path.unlink(missing_ok=True)
+            return await self._simple_concatenate(audio_files, output_path)
+    
+    def _remux_audio_files(self, audio_files: List[Path], output_path: Path) -> None:
+        """
+        Stream-copy the audio packets of every input into a single output container
+        
+        Args:
+            audio_files: List of audio file paths
+            output_path: Output file path
+        """
+        out_stream = None
+        # End time of the audio written so far, used to shift later inputs
+        offset = Fraction(0)
+        
+        with av.open(str(output_path), 'w') as output:
+            for audio_file in audio_files:
+                if not audio_file.exists():
+                    logger.warning(f"Audio file not found: {audio_file}")
+                    continue
+                
+                with av.open(str(audio_file)) as in_container:
+                    in_stream = in_container.streams.audio[0]
+                    if out_stream is None:
+                        out_stream = output.add_stream(template=in_stream)
+                    
+                    shift = int(offset / in_stream.time_base)
+                    end = offset
+                    
+                    for packet in in_container.demux(in_stream):
+                        # Skip the empty packets used to flush the demuxer
+                        if packet.dts is None:
+                            continue
+                        
+                        packet.dts += shift
+                        if packet.pts is not None:
+                            packet.pts += shift
+                            end = max(end, (packet.pts + packet.duration) * in_stream.time_base)
+                        
+                        packet.stream = out_stream
+                        output.mux(packet)
+                    
+                    offset = end
     
     async def _simple_concatenate(self, audio_files: List[Path], output_path: Path) -> bool:
         """
@@ -135,25 +158,7 @@ class AudioProcessor:
             True if successful
         """
         try:
-            with open(output_path, 'wb') as output_file:
-                for i, audio_file in enumerate(audio_files):
-                    if not audio_file.exists():
-                        logger.warning(f"Audio file not found: {audio_file}")
-                        continue
-                    
-                    with open(audio_file, 'rb') as input_file:
-                        if i == 0:
-                            # For first file, copy everything
-                            output_file.write(input_file.read())
-                        else:
-                            # For subsequent files, skip potential headers
-                            data = input_file.read()
-                            # Simple heuristic: skip first 128 bytes which might contain headers
-                            if len(data) > 128:
-                                output_file.write(data[128:])
-                            else:
-                                output_file.write(data)
-            
+            await asyncio.to_thread(self._concatenate_files, audio_files, output_path)
             logger.info(f"Successfully concatenated {len(audio_files)} files (simple method)")
             return True
             
@@ -161,6 +166,46 @@ class AudioProcessor:
             logger.error(f"Error in simple concatenation: {str(e)}")
             return False
     
+    def _concatenate_files(self, audio_files: List[Path], output_path: Path) -> None:
+        """
+        Stream the inputs into one file, dropping the ID3v2 tag of every input after the first
+        
+        Args:
+            audio_files: List of audio file paths
+            output_path: Output file path
+        """
+        with open(output_path, 'wb', buffering=COPY_BUFFER_SIZE) as output_file:
+            for i, audio_file in enumerate(audio_files):
+                if not audio_file.exists():
+                    logger.warning(f"Audio file not found: {audio_file}")
+                    continue
+                
+                with open(audio_file, 'rb') as input_file:
+                    if i > 0:
+                        input_file.seek(self._id3_tag_size(input_file.read(10)))
+                    
+                    shutil.copyfileobj(input_file, output_file, COPY_BUFFER_SIZE)
+    
+    @staticmethod
+    def _id3_tag_size(header: bytes) -> int:
+        """
+        Get the size of the ID3v2 tag a file starts with
+        
+        Args:
+            header: First 10 bytes of the file
+            
+        Returns:
+            Number of bytes to skip to reach the audio frames (0 if untagged)
+        """
+        if len(header) < 10 or not header.startswith(b'ID3'):
+            return 0
+        
+        # Tag size is a 28-bit "syncsafe" integer (7 bits per byte)
+        size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+        
+        # Header, tag body, plus a 10-byte footer when the footer flag is set
+        return 10 + size + (10 if header[5] & 0x10 else 0)
+    
     async def get_audio_duration(self, audio_path: Path) -> Optional[float]:
         """
         Get audio file duration in seconds
@@ -171,16 +216,33 @@ class AudioProcessor:
         Returns:
             Duration in seconds, or None if unable to determine
         """
-        if not audio_path.exists():
+        stat = _stat_or_none(audio_path)
+        if stat is None:
+            return None
+        
+        cache_key = (str(audio_path), stat.st_size, stat.st_mtime_ns)
+        if cache_key in self._duration_cache:
+            return self._duration_cache[cache_key]
+        
+        duration = await self._probe_duration(audio_path)
+        if duration is None:
+            # Fallback: estimate based on file size and the configured bitrate
+            duration = stat.st_size / self._bytes_per_sec
+        
+        self._duration_cache[cache_key] = duration
+        return duration
+    
+    async def _probe_duration(self, audio_path: Path) -> Optional[float]:
+        """Read the exact duration with ffprobe, if it is installed"""
+        if not self._has_ffprobe:
             return None
         
         try:
-            # Try using ffprobe if available
             cmd = [
                 'ffprobe',
                 '-v', 'quiet',
-                '-print_format', 'json',
-                '-show_format',
+                '-show_entries', 'format=duration',
+                '-of', 'csv=p=0',
                 str(audio_path)
             ]
             
@@ -193,19 +255,13 @@ class AudioProcessor:
             stdout, stderr = await process.communicate()
             
             if process.returncode == 0:
-                import json
-                data = json.loads(stdout.decode())
-                duration = float(data['format']['duration'])
-                return duration
+                # Only the duration is requested, printed as a bare number
+                return float(stdout.decode().strip())
             
         except:
             pass
         
-        # Fallback: estimate based on file size (very rough)
-        file_size = audio_path.stat().st_size
-        # Rough estimate: 1 minute of MP3 ≈ 1MB at 128kbps
-        estimated_duration = file_size / (128 * 1024 / 8)  # bytes per second
-        return estimated_duration
+        return None
     
     async def validate_audio_file(self, audio_path: Path) -> bool:
         """
@@ -217,37 +273,49 @@ class AudioProcessor:
         Returns:
             True if file appears to be valid audio
         """
-        if not audio_path.exists():
+        try:
+            fd = os.open(audio_path, os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logger.error(f"Error validating audio file {audio_path}: {str(e)}")
             return False
         
         try:
-            # Check file size
-            if audio_path.stat().st_size < 100:  # Too small to be valid audio
+            # Check file size on the open descriptor
+            if os.fstat(fd).st_size < 100:  # Too small to be valid audio
                 return False
             
-            # Check if it starts with MP3 header
-            with open(audio_path, 'rb') as f:
-                header = f.read(3)
-                # MP3 files typically start with ID3 tag or MP3 frame sync
-                if header.startswith(b'ID3') or header[0:2] == b'\xff\xfb':
-                    return True
-            
-            return False
+            # A fresh descriptor reads from offset 0, no file object needed
+            header = os.read(fd, 3)
             
-        except Exception as e:
+        except OSError as e:
             logger.error(f"Error validating audio file {audio_path}: {str(e)}")
             return False
+        
+        finally:
+            os.close(fd)
+        
+        # MP3 files typically start with ID3 tag or MP3 frame sync
+        return header == b'ID3' or header[:2] == b'\xff\xfb'
     
     async def cleanup_temp_files(self):
         """Clean up temporary files"""
         try:
-            for temp_file in self.temp_dir.glob("*"):
-                if temp_file.is_file():
-                    temp_file.unlink()
+            await asyncio.to_thread(self._remove_temp_files)
             logger.info("Cleaned up temporary audio files")
         except Exception as e:
             logger.error(f"Error cleaning up temp files: {str(e)}")
     
+    def _remove_temp_files(self) -> None:
+        """Unlink every regular file in the temp directory (blocking)"""
+        # scandir entries carry the file type from the directory listing,
+        # so no extra stat() is needed per file
+        with os.scandir(self.temp_dir) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False):
+                    os.unlink(entry.path)
+    
     def estimate_processing_time(self, text_length: int) -> float:
         """
         Estimate processing time based on text length
@@ -3,6 +3,7 @@ Configuration management for PDF to Audio API
 """
 
 import os
+from functools import cached_property
 from pathlib import Path
 from typing import List
 from dotenv import load_dotenv
@@ -27,6 +28,12 @@ class Settings:
     MAX_FILE_SIZE_MB: int = int(os.getenv("MAX_FILE_SIZE_MB", "50"))
     UPLOAD_PATH: str = os.getenv("UPLOAD_PATH", "uploads")
     AUDIO_OUTPUT_PATH: str = os.getenv("AUDIO_OUTPUT_PATH", "audio_output")
+    CACHE_PATH: str = os.getenv("CACHE_PATH", "cache")
+    CHUNK_CACHE_TTL_SECONDS: int = int(os.getenv("CHUNK_CACHE_TTL_SECONDS", "604800"))
+    
+    # Serve downloads via nginx X-Accel-Redirect (internal location must map to audio_output)
+    USE_XACCEL: bool = os.getenv("USE_XACCEL", "False").lower() == "true"
+    XACCEL_AUDIO_PREFIX: str = os.getenv("XACCEL_AUDIO_PREFIX", "/_audio_internal/")
     
     # CORS Configuration
     ALLOWED_ORIGINS: List[str] = [
@@ -40,28 +47,42 @@ class Settings:
     DEFAULT_SPEED: float = float(os.getenv("DEFAULT_SPEED", "1.0"))
     DEFAULT_VOLUME: float = float(os.getenv("DEFAULT_VOLUME", "1.0"))
     MAX_CHUNK_SIZE: int = int(os.getenv("MAX_CHUNK_SIZE", "2000"))
+    TTS_BITRATE_KBPS: int = int(os.getenv("TTS_BITRATE_KBPS", "128"))
     
     # Rate Limiting
     TTS_REQUEST_DELAY: float = float(os.getenv("TTS_REQUEST_DELAY", "1.0"))
     MAX_RETRIES: int = int(os.getenv("MAX_RETRIES", "3"))
+    TTS_CONCURRENCY: int = int(os.getenv("TTS_CONCURRENCY", "4"))
+    TTS_REQUESTS_PER_SECOND: float = float(os.getenv("TTS_REQUESTS_PER_SECOND", "2.0"))
+    
+    # Job Tracking
+    MAX_TRACKED_JOBS: int = int(os.getenv("MAX_TRACKED_JOBS", "10000"))
+    JOB_STATUS_TTL_SECONDS: int = int(os.getenv("JOB_STATUS_TTL_SECONDS", "3600"))
     
     # Logging
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
     
-    @property
+    @cached_property
     def upload_dir(self) -> Path:
-        """Get upload directory path"""
+        """Get upload directory path (created on first access)"""
         path = Path(self.UPLOAD_PATH)
         path.mkdir(exist_ok=True)
         return path
     
-    @property
+    @cached_property
     def audio_output_dir(self) -> Path:
-        """Get audio output directory path"""
+        """Get audio output directory path (created on first access)"""
         path = Path(self.AUDIO_OUTPUT_PATH)
         path.mkdir(exist_ok=True)
         return path
     
+    @cached_property
+    def cache_dir(self) -> Path:
+        """Get extracted-text cache directory path (created on first access)"""
+        path = Path(self.CACHE_PATH)
+        path.mkdir(exist_ok=True)
+        return path
+    
     @property
     def max_file_size_bytes(self) -> int:
         """Get max file size in bytes"""
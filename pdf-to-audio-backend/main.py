@@ -3,19 +3,31 @@ PDF to Audio Conversion API - Simple Working Version
 """
 
 import os
+import asyncio
+import hashlib
+import json
 import tempfile
 import time
 import logging
 from pathlib import Path
-from typing import Optional, List
+from typing import Any, Dict, Optional, List
 import uuid
 import threading
+from urllib.parse import quote
 
+import httpx
+from cachetools import TTLCache
+from dotenv import load_dotenv
 from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 
+from config import settings
+from pdf_processor import PDFProcessor
+from tts_service import TTSService
+from audio_utils import AudioProcessor
+
 # Load environment variables
 load_dotenv()
 
@@ -33,15 +45,25 @@ app = FastAPI(
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # In production, specify your frontend domain
-    allow_credentials=True,
+    allow_origins=settings.ALLOWED_ORIGINS,
+    # Browsers reject credentials with a wildcard origin
+    allow_credentials="*" not in settings.ALLOWED_ORIGINS,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
 # Initialize services
 pdf_processor = PDFProcessor()
-tts_service = TTSService()
+# One pooled HTTP client shared by every TTS request, closed on shutdown
+http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+    timeout=30.0
+)
+tts_service = TTSService(
+    client=http_client,
+    requests_per_second=settings.TTS_REQUESTS_PER_SECOND
+)
 audio_processor = AudioProcessor()
 
 # Create directories for file storage
@@ -50,11 +72,46 @@ AUDIO_DIR = Path("audio_output")
 UPLOAD_DIR.mkdir(exist_ok=True)
 AUDIO_DIR.mkdir(exist_ok=True)
 
+# Read size used when streaming uploads to disk
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+class LargeChunkFileResponse(FileResponse):
+    """FileResponse that reads 1 MiB per thread hop instead of 64 KiB"""
+    
+    chunk_size = 1 << 20
+
+
 # Serve static audio files
 app.mount("/audio", StaticFiles(directory="audio_output"), name="audio")
 
-# In-memory storage for conversion status (use Redis in production)
-conversion_status = {}
+# In-memory storage for conversion status (use Redis in production).
+# Bounded and expiring so finished jobs don't accumulate forever.
+conversion_status = TTLCache(
+    maxsize=settings.MAX_TRACKED_JOBS,
+    ttl=settings.JOB_STATUS_TTL_SECONDS
+)
+
+# PDF hash of each job, so cleanup can also remove the job's cached text
+job_pdf_hashes = TTLCache(
+    maxsize=settings.MAX_TRACKED_JOBS,
+    ttl=settings.JOB_STATUS_TTL_SECONDS
+)
+
+# Bump whenever extraction, cleaning or chunking changes, so chunks cached
+# by an older pipeline are never served
+CHUNK_CACHE_VERSION = 2
+
+
+@app.on_event("startup")
+async def prune_chunk_cache_on_startup():
+    """Drop cached text chunks left over from earlier runs"""
+    await asyncio.to_thread(prune_chunk_cache)
+
+
+@app.on_event("shutdown")
+async def close_http_client():
+    """Release pooled TTS connections"""
+    await http_client.aclose()
 
 
 @app.get("/")
@@ -106,16 +163,17 @@ async def convert_pdf_to_audio(
         # Save uploaded file temporarily
         file_path = UPLOAD_DIR / f"{job_id}_{file.filename}"
         
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        # Stream to disk in 1 MiB pieces rather than buffering the whole upload
+        pdf_hash = await asyncio.to_thread(save_upload, file, file_path)
+        job_pdf_hashes[job_id] = pdf_hash
         
         # Start background conversion
         background_tasks.add_task(
             process_pdf_conversion,
             job_id,
             file_path,
-            file.filename
+            file.filename,
+            pdf_hash
         )
         
         return {
@@ -134,10 +192,11 @@ async def get_conversion_status(job_id: str):
     """
     Get conversion status by job ID
     """
-    if job_id not in conversion_status:
+    status = conversion_status.get(job_id)
+    if status is None:
         raise HTTPException(status_code=404, detail="Job not found")
     
-    return conversion_status[job_id]
+    return status
 
 
 @app.get("/api/download-audio/{job_id}")
@@ -145,10 +204,10 @@ async def download_audio(job_id: str):
     """
     Download converted audio file
     """
-    if job_id not in conversion_status:
+    status = conversion_status.get(job_id)
+    if status is None:
         raise HTTPException(status_code=404, detail="Job not found")
     
-    status = conversion_status[job_id]
     if status["status"] != "completed":
         raise HTTPException(status_code=400, detail="Conversion not completed")
     
@@ -156,80 +215,180 @@ async def download_audio(job_id: str):
     if not audio_file.exists():
         raise HTTPException(status_code=404, detail="Audio file not found")
     
-    return FileResponse(
+    download_name = status['filename'].replace('.pdf', '.mp3')
+    
+    if settings.USE_XACCEL:
+        # Let the reverse proxy send the file straight from disk
+        return Response(
+            media_type="audio/mpeg",
+            headers={
+                "X-Accel-Redirect": f"{settings.XACCEL_AUDIO_PREFIX}{job_id}.mp3",
+                "Content-Disposition": f"attachment; filename*=utf-8''{quote(download_name)}"
+            }
+        )
+    
+    return LargeChunkFileResponse(
         path=audio_file,
         media_type="audio/mpeg",
-        filename=f"{status['filename'].replace('.pdf', '.mp3')}"
+        filename=download_name
     )
 
 
-async def process_pdf_conversion(job_id: str, file_path: Path, filename: str):
+def save_upload(upload: UploadFile, destination: Path) -> str:
+    """
+    Copy an uploaded file to disk in fixed-size pieces (blocking)
+    
+    Returns:
+        SHA-256 hex digest of the uploaded content
+    """
+    digest = hashlib.sha256()
+    with open(destination, "wb") as buffer:
+        while chunk := upload.file.read(UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+            buffer.write(chunk)
+    return digest.hexdigest()
+
+
+def chunk_cache_path(pdf_hash: str) -> Path:
+    """Cache file for a PDF's text chunks at the current chunk size and pipeline version"""
+    return settings.cache_dir / (
+        f"{pdf_hash}_{pdf_processor.max_chunk_size}_v{CHUNK_CACHE_VERSION}.chunks.json"
+    )
+
+
+def load_cached_chunks(pdf_hash: str) -> Optional[List[str]]:
+    """Load previously extracted text chunks for a PDF, if cached (blocking)"""
+    cache_path = chunk_cache_path(pdf_hash)
+    try:
+        with open(cache_path, encoding="utf-8") as f:
+            chunks = json.load(f)
+        # Entries are pruned by age since last use, not since creation
+        os.utime(cache_path)
+        return chunks
+    except (OSError, ValueError):
+        return None
+
+
+def store_cached_chunks(pdf_hash: str, chunks: List[str]):
+    """Cache extracted text chunks for a PDF (blocking)"""
+    cache_path = chunk_cache_path(pdf_hash)
+    # Write to a temporary name first so readers never see a partial file
+    tmp_path = cache_path.with_name(f"{cache_path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(chunks, f)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning(f"Failed to cache text chunks: {str(e)}")
+        tmp_path.unlink(missing_ok=True)
+    
+    prune_chunk_cache()
+
+
+def prune_chunk_cache():
+    """Delete cache files unused for longer than CHUNK_CACHE_TTL_SECONDS (blocking)"""
+    cutoff = time.time() - settings.CHUNK_CACHE_TTL_SECONDS
+    try:
+        with os.scandir(settings.cache_dir) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file() and entry.stat().st_mtime < cutoff:
+                        os.unlink(entry.path)
+                except OSError:
+                    pass
+    except OSError as e:
+        logger.warning(f"Failed to prune text chunk cache: {str(e)}")
+
+
+def update_status(job_id: str, updates: Dict[str, Any]):
+    """
+    Apply a status update, ignoring jobs that were cleaned up or evicted
+    
+    The entry is stored again on every update, which restarts its TTL, so
+    jobs don't expire while they are running and finished jobs stay
+    available for the full TTL after completion.
+    """
+    status = conversion_status.get(job_id)
+    if status is not None:
+        status.update(updates)
+        conversion_status[job_id] = status
+
+
+async def process_pdf_conversion(job_id: str, file_path: Path, filename: str, pdf_hash: str):
     """
     Background task to process PDF conversion
     """
     try:
-        # Update status: Extracting text
-        conversion_status[job_id].update({
-            "progress": 10,
-            "message": "Extracting text from PDF..."
-        })
-        
-        # Extract text from PDF
-        text_content = await pdf_processor.extract_text(file_path)
+        # Identical uploads reuse the chunks extracted the first time
+        text_chunks = await asyncio.to_thread(load_cached_chunks, pdf_hash)
         
-        if not text_content.strip():
-            raise Exception("No text found in PDF")
-        
-        # Update status: Processing text
-        conversion_status[job_id].update({
-            "progress": 30,
-            "message": "Processing and chunking text..."
-        })
-        
-        # Chunk text for TTS processing
-        text_chunks = pdf_processor.chunk_text(text_content)
+        if text_chunks is None:
+            # Update status: Extracting text
+            update_status(job_id, {
+                "progress": 10,
+                "message": "Extracting and chunking text from PDF..."
+            })
+            
+            # Pages are chunked as they are extracted, never as one big string
+            text_chunks = [chunk async for chunk in pdf_processor.stream(file_path)]
+            
+            if not text_chunks:
+                raise Exception("No text found in PDF")
+            
+            await asyncio.to_thread(store_cached_chunks, pdf_hash, text_chunks)
+        else:
+            logger.info(f"Reusing cached text chunks for job {job_id}")
         
         # Update status: Converting to speech
-        conversion_status[job_id].update({
+        update_status(job_id, {
             "progress": 50,
             "message": "Converting text to speech..."
         })
         
-        # Convert text chunks to audio
-        audio_files = []
+        # Convert text chunks to audio concurrently; tts_service paces the requests
         total_chunks = len(text_chunks)
+        semaphore = asyncio.Semaphore(settings.TTS_CONCURRENCY)
+        finished_chunks = 0
         
-        for i, chunk in enumerate(text_chunks):
+        async def convert_chunk(i: int, chunk: str) -> Path:
+            nonlocal finished_chunks
+            
             try:
-                audio_data = await tts_service.text_to_speech(chunk)
+                async with semaphore:
+                    audio_data = await tts_service.text_to_speech(chunk)
+                    
+                    # Save chunk audio without blocking the event loop
+                    chunk_file = AUDIO_DIR / f"{job_id}_chunk_{i}.mp3"
+                    await asyncio.to_thread(chunk_file.write_bytes, audio_data)
                 
-                # Save chunk audio
-                chunk_file = AUDIO_DIR / f"{job_id}_chunk_{i}.mp3"
-                with open(chunk_file, "wb") as f:
-                    f.write(audio_data)
-                
-                audio_files.append(chunk_file)
-                
-                # Update progress
-                chunk_progress = 50 + (i + 1) / total_chunks * 30
-                conversion_status[job_id].update({
+                return chunk_file
+            finally:
+                # Failed chunks advance progress too; their errors surface via gather
+                finished_chunks += 1
+                chunk_progress = 50 + finished_chunks / total_chunks * 30
+                update_status(job_id, {
                     "progress": chunk_progress,
-                    "message": f"Converting chunk {i + 1}/{total_chunks}..."
+                    "message": f"Converting chunk {finished_chunks}/{total_chunks}..."
                 })
-                
-                # Small delay to prevent API rate limiting
-                await asyncio.sleep(0.5)
-                
-            except Exception as e:
-                logger.error(f"Error processing chunk {i}: {str(e)}")
-                # Continue with other chunks
+        
+        results = await asyncio.gather(
+            *(convert_chunk(i, chunk) for i, chunk in enumerate(text_chunks)),
+            return_exceptions=True
+        )
+        
+        # Keep chunk order; failed chunks are skipped so the rest still convert
+        audio_files = []
+        for i, result in enumerate(results):
+            if isinstance(result, Exception):
+                logger.error(f"Error processing chunk {i}: {str(result)}")
                 continue
+            audio_files.append(result)
         
         if not audio_files:
             raise Exception("Failed to convert any text chunks to audio")
         
         # Update status: Merging audio
-        conversion_status[job_id].update({
+        update_status(job_id, {
             "progress": 85,
             "message": "Merging audio files..."
         })
@@ -238,18 +397,18 @@ async def process_pdf_conversion(job_id: str, file_path: Path, filename: str):
         final_audio_path = AUDIO_DIR / f"{job_id}.mp3"
         await audio_processor.merge_audio_files(audio_files, final_audio_path)
         
-        # Clean up chunk files
-        for chunk_file in audio_files:
-            try:
-                chunk_file.unlink()
-            except:
-                pass
+        # Clean up chunk files in parallel worker threads
+        await asyncio.gather(
+            *(asyncio.to_thread(chunk_file.unlink, missing_ok=True) for chunk_file in audio_files),
+            return_exceptions=True
+        )
         
         # Calculate estimated duration (rough estimate)
-        estimated_duration = len(text_content.split()) / 150  # ~150 words per minute
+        word_count = sum(len(chunk.split()) for chunk in text_chunks)
+        estimated_duration = word_count / 150  # ~150 words per minute
         
         # Update status: Completed
-        conversion_status[job_id].update({
+        update_status(job_id, {
             "status": "completed",
             "progress": 100,
             "message": "Conversion completed successfully!",
@@ -265,7 +424,7 @@ async def process_pdf_conversion(job_id: str, file_path: Path, filename: str):
             
     except Exception as e:
         logger.error(f"Conversion failed for job {job_id}: {str(e)}")
-        conversion_status[job_id].update({
+        update_status(job_id, {
             "status": "failed",
             "progress": 0,
             "message": f"Conversion failed: {str(e)}"
@@ -283,10 +442,13 @@ async def cleanup_job(job_id: str):
     """
     Clean up job files and status
     """
-    if job_id in conversion_status:
-        del conversion_status[job_id]
+    conversion_status.pop(job_id, None)
+    
+    # Clean up files, including the document's cached text
+    pdf_hash = job_pdf_hashes.pop(job_id, None)
+    if pdf_hash is not None:
+        await asyncio.to_thread(chunk_cache_path(pdf_hash).unlink, missing_ok=True)
     
-    # Clean up files
     audio_file = AUDIO_DIR / f"{job_id}.mp3"
     if audio_file.exists():
         audio_file.unlink()
@@ -4,13 +4,14 @@ This version uses minimal dependencies and mock processing for demonstration
 """
 
 import os
-import time
+import asyncio
+import shutil
 import uuid
 import json
-import threading
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Set
 
+from cachetools import TTLCache
 from fastapi import FastAPI, File, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import Response
@@ -22,11 +23,17 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# Configure CORS
+# Configure CORS with an explicit allowlist ("*" allows any origin)
+ALLOWED_ORIGINS = [
+    origin.strip()
+    for origin in os.getenv("ALLOWED_ORIGINS", "http://localhost:3000,http://localhost:5173").split(",")
+    if origin.strip()
+]
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # In production, specify your frontend domain
-    allow_credentials=True,
+    allow_origins=ALLOWED_ORIGINS,
+    # Browsers reject credentials with a wildcard origin
+    allow_credentials="*" not in ALLOWED_ORIGINS,
     allow_methods=["*"],
     allow_headers=["*"],
 )
@@ -37,8 +44,14 @@ AUDIO_DIR = Path("audio_output")
 UPLOAD_DIR.mkdir(exist_ok=True)
 AUDIO_DIR.mkdir(exist_ok=True)
 
-# In-memory storage for conversion status
-conversion_status: Dict[str, Dict[str, Any]] = {}
+# Read size used when streaming uploads to disk
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# In-memory storage for conversion status, bounded and expired after an hour
+conversion_status: TTLCache = TTLCache(maxsize=10_000, ttl=3600)
+
+# Strong references to running simulations so they aren't garbage collected
+background_jobs: Set[asyncio.Task] = set()
 
 
 @app.get("/")
@@ -85,17 +98,12 @@ async def convert_pdf_to_audio(file: UploadFile = File(...)):
         
         # Save uploaded file temporarily (optional for demo)
         file_path = UPLOAD_DIR / f"{job_id}_{file.filename}"
-        content = await file.read()
-        with open(file_path, "wb") as buffer:
-            buffer.write(content)
+        await asyncio.to_thread(save_upload, file, file_path)
         
         # Start background conversion simulation
-        thread = threading.Thread(
-            target=simulate_pdf_conversion,
-            args=(job_id, file.filename)
-        )
-        thread.daemon = True
-        thread.start()
+        task = asyncio.create_task(simulate_pdf_conversion(job_id, file.filename))
+        background_jobs.add(task)
+        task.add_done_callback(background_jobs.discard)
         
         return {
             "job_id": job_id,
@@ -110,35 +118,52 @@ async def convert_pdf_to_audio(file: UploadFile = File(...)):
 @app.get("/api/conversion-status/{job_id}")
 async def get_conversion_status(job_id: str):
     """Get conversion status by job ID"""
-    if job_id not in conversion_status:
+    status = conversion_status.get(job_id)
+    if status is None:
         raise HTTPException(status_code=404, detail="Job not found")
     
-    return conversion_status[job_id]
+    return status
 
 
 @app.get("/api/download-audio/{job_id}")
 async def download_audio(job_id: str):
     """Download converted audio file"""
-    if job_id not in conversion_status:
+    status = conversion_status.get(job_id)
+    if status is None:
         raise HTTPException(status_code=404, detail="Job not found")
     
-    status = conversion_status[job_id]
     if status["status"] != "completed":
         raise HTTPException(status_code=400, detail="Conversion not completed")
     
-    # Generate mock audio content
-    mock_audio = generate_mock_audio()
-    
     filename = status['filename'].replace('.pdf', '.mp3')
     
     return Response(
-        content=mock_audio,
+        content=MOCK_AUDIO_BYTES,
         media_type="audio/mpeg",
         headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
 
 
-def simulate_pdf_conversion(job_id: str, filename: str):
+def save_upload(upload: UploadFile, destination: Path):
+    """Copy an uploaded file to disk in fixed-size pieces (blocking)"""
+    with open(destination, "wb") as buffer:
+        shutil.copyfileobj(upload.file, buffer, UPLOAD_CHUNK_SIZE)
+
+
+def update_status(job_id: str, updates: Dict[str, Any]):
+    """
+    Apply a status update, ignoring jobs that were cleaned up or expired
+    
+    Storing the entry again restarts its TTL, so running jobs don't expire
+    and finished ones stay available for the full TTL after completion.
+    """
+    status = conversion_status.get(job_id)
+    if status is not None:
+        status.update(updates)
+        conversion_status[job_id] = status
+
+
+async def simulate_pdf_conversion(job_id: str, filename: str):
     """Simulate PDF conversion process"""
     try:
         # Simulate different stages with delays
@@ -154,15 +179,15 @@ def simulate_pdf_conversion(job_id: str, filename: str):
         ]
         
         for progress, message in stages:
-            time.sleep(1.5)  # Simulate processing time
-            conversion_status[job_id].update({
+            await asyncio.sleep(1.5)  # Simulate processing time
+            update_status(job_id, {
                 'progress': progress,
                 'message': message
             })
         
         # Complete conversion
-        time.sleep(2)
-        conversion_status[job_id].update({
+        await asyncio.sleep(2)
+        update_status(job_id, {
             'status': 'completed',
             'progress': 100,
             'message': 'Conversion completed successfully!',
@@ -171,40 +196,36 @@ def simulate_pdf_conversion(job_id: str, filename: str):
         })
         
     except Exception as e:
-        conversion_status[job_id].update({
+        update_status(job_id, {
             'status': 'failed',
             'progress': 0,
             'message': f'Conversion failed: {str(e)}'
         })
 
 
-def generate_mock_audio() -> bytes:
-    """Generate a simple mock MP3 file for demonstration"""
+def _build_mock_audio() -> bytes:
+    """Build a simple mock MP3 file for demonstration"""
     
     # Create a basic MP3 file with ID3 header and silence
     id3_header = b'ID3\x03\x00\x00\x00\x00\x00\x00'
     
     # MP3 frame header for 44.1kHz, stereo, 128kbps
-    mp3_frame = bytes([
-        0xFF, 0xFB, 0x90, 0x00,  # Sync word and header
-        0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
-        0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
-        0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
-        0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00
-    ])
+    mp3_frame = b'\xff\xfb\x90\x00' + b'\x00' * 32
     
     # Create silence frames (about 10 seconds of silence)
-    silence_frame = bytes([0x00] * 144)
-    frames = [mp3_frame] + [silence_frame] * 400
+    silence_frame = b'\x00' * 144
     
-    return id3_header + b''.join(frames)
+    return id3_header + mp3_frame + silence_frame * 400
+
+
+# The mock audio never changes, so build it once and serve the same buffer
+MOCK_AUDIO_BYTES = _build_mock_audio()
 
 
 @app.delete("/api/cleanup/{job_id}")
 async def cleanup_job(job_id: str):
     """Clean up job files and status"""
-    if job_id in conversion_status:
-        del conversion_status[job_id]
+    conversion_status.pop(job_id, None)
     
     # Clean up uploaded file
     for file_path in UPLOAD_DIR.glob(f"{job_id}_*"):
@@ -2,19 +2,33 @@
 PDF processing utilities for text extraction and chunking
 """
 
-import pdfplumber
 import fitz  # PyMuPDF
 import re
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional
 
 logger = logging.getLogger(__name__)
 
+# PyMuPDF output shorter than this (or mostly unmapped glyphs) falls back to pdfplumber
+MIN_TEXT_CHARS = 50
+MAX_UNMAPPED_RATIO = 0.1
+
+# Number of leading pages whose PyMuPDF text is judged together before streaming,
+# so a single garbled cover page doesn't decide the extractor for the whole document
+USABILITY_SAMPLE_PAGES = 5
+
+# Plain text extraction flags, without image handling
+PYMUPDF_TEXT_FLAGS = fitz.TEXTFLAGS_TEXT & ~fitz.TEXT_PRESERVE_IMAGES
+
 
 class PDFProcessor:
     """Handle PDF text extraction and processing"""
     
+    __slots__ = ('max_chunk_size', '_missing_space_re', '_sent_re', '_char_table')
+    
     def __init__(self, max_chunk_size: int = 2000):
         """
         Initialize PDF processor
@@ -23,6 +37,23 @@ class PDFProcessor:
             max_chunk_size: Maximum characters per text chunk for TTS
         """
         self.max_chunk_size = max_chunk_size
+        
+        # Missing space before a capital (after a lowercase letter or .!?),
+        # matched as the empty position between them so a plain ' ' is inserted
+        self._missing_space_re = re.compile(r'(?<=[a-z.!?])(?=[A-Z])')
+        
+        # Sentence boundaries used when a paragraph is too long for one chunk
+        self._sent_re = re.compile(r'[.!?]+\s+')
+        
+        # Per-character fixes done by str.translate: drop control characters
+        # and straighten curly quotes
+        control_chars = [*range(0x00, 0x09), 0x0b, 0x0c, *range(0x0e, 0x20),
+                         *range(0x7f, 0x85), *range(0x86, 0xa0)]
+        self._char_table = dict.fromkeys(control_chars)
+        self._char_table.update({
+            0x201c: '"', 0x201d: '"', 0x201e: '"',
+            0x2018: "'", 0x2019: "'", 0x201b: "'",
+        })
     
     async def extract_text(self, pdf_path: Path) -> str:
         """
@@ -34,21 +65,8 @@ class PDFProcessor:
         Returns:
             Extracted text content
         """
-        text_content = ""
-        
         try:
-            # Try pdfplumber first (better for text-based PDFs)
-            text_content = await self._extract_with_pdfplumber(pdf_path)
-            
-            if not text_content.strip():
-                # Fallback to PyMuPDF (better for some PDF types)
-                text_content = await self._extract_with_pymupdf(pdf_path)
-            
-            if not text_content.strip():
-                raise Exception("No readable text found in PDF")
-            
-            # Clean and normalize text
-            text_content = self._clean_text(text_content)
+            text_content = "\n\n".join([page async for page in self._iter_pages(pdf_path)])
             
             logger.info(f"Extracted {len(text_content)} characters from PDF")
             return text_content
@@ -57,44 +75,209 @@ class PDFProcessor:
             logger.error(f"Failed to extract text from PDF: {str(e)}")
             raise Exception(f"PDF text extraction failed: {str(e)}")
     
-    async def _extract_with_pdfplumber(self, pdf_path: Path) -> str:
-        """Extract text using pdfplumber"""
-        text_parts = []
+    async def stream(self, pdf_path: Path) -> AsyncIterator[str]:
+        """
+        Extract and chunk a PDF page by page, so the whole document is never held as one string
         
-        try:
-            with pdfplumber.open(pdf_path) as pdf:
-                for page_num, page in enumerate(pdf.pages):
-                    page_text = page.extract_text()
-                    if page_text:
-                        text_parts.append(page_text)
-                        logger.debug(f"Extracted text from page {page_num + 1}")
+        Args:
+            pdf_path: Path to PDF file
             
-            return "\n\n".join(text_parts)
+        Yields:
+            Text chunks suitable for TTS processing, as soon as each one is complete
+        """
+        chunker = _TextChunker(self)
+        chunk_count = 0
+        
+        try:
+            async for page_text in self._iter_pages(pdf_path):
+                for chunk in chunker.add_text(page_text):
+                    chunk_count += 1
+                    yield chunk
             
         except Exception as e:
-            logger.warning(f"pdfplumber extraction failed: {str(e)}")
-            return ""
+            logger.error(f"Failed to extract text from PDF: {str(e)}")
+            raise Exception(f"PDF text extraction failed: {str(e)}")
+        
+        for chunk in chunker.finish():
+            chunk_count += 1
+            yield chunk
+        
+        logger.info(f"Created {chunk_count} text chunks")
     
-    async def _extract_with_pymupdf(self, pdf_path: Path) -> str:
-        """Extract text using PyMuPDF as fallback"""
-        text_parts = []
+    async def _iter_pages(self, pdf_path: Path) -> AsyncIterator[str]:
+        """
+        Yield cleaned text page by page, trying PyMuPDF first and pdfplumber as fallback
+        
+        The first PyMuPDF pages are held back and judged together, so the
+        fallback can still replace them if the text isn't usable.
+        
+        Args:
+            pdf_path: Path to PDF file
+            
+        Yields:
+            Cleaned, non-empty page text
+        """
+        held_pages = []
+        held_chars = 0
+        usable = False
+        # Whether the sample covers the whole document, so it can be replayed
+        # instead of reading the document again
+        sampled_all = False
+        pages = self._iter_pymupdf_pages(pdf_path)
         
         try:
-            doc = fitz.open(pdf_path)
+            try:
+                async for page_text in pages:
+                    held_pages.append(page_text)
+                    held_chars += len(page_text.strip())
+                    if len(held_pages) >= USABILITY_SAMPLE_PAGES and held_chars >= MIN_TEXT_CHARS:
+                        break
+                else:
+                    sampled_all = True
+                
+                usable = self._is_usable_text("\n\n".join(held_pages))
+            except Exception as e:
+                logger.warning(f"PyMuPDF extraction failed: {str(e)}")
             
-            for page_num in range(len(doc)):
-                page = doc.load_page(page_num)
-                page_text = page.get_text()
+            if usable:
+                yielded = False
+                for page_text in held_pages:
+                    page_text = self._clean_text(page_text)
+                    if page_text:
+                        yielded = True
+                        yield page_text
+                
+                async for page_text in pages:
+                    page_text = self._clean_text(page_text)
+                    if page_text:
+                        yielded = True
+                        yield page_text
+                
+                if yielded:
+                    return
+        finally:
+            await pages.aclose()
+        
+        if not sampled_all:
+            held_pages.clear()
+        
+        # Fallback to pdfplumber (better for some PDF types)
+        found_text = False
+        try:
+            async for page_text in self._iter_pdfplumber_pages(pdf_path):
+                page_text = self._clean_text(page_text)
                 if page_text:
-                    text_parts.append(page_text)
-                    logger.debug(f"Extracted text from page {page_num + 1}")
+                    found_text = True
+                    yield page_text
+        except Exception as e:
+            # Once text has been yielded the document can't be switched to
+            # another extractor, so a failure must fail the extraction
+            if found_text:
+                raise
+            logger.warning(f"pdfplumber extraction failed: {str(e)}")
+        
+        if not found_text and sampled_all:
+            # Keep whatever PyMuPDF found; the sample already holds every page
+            for page_text in held_pages:
+                page_text = self._clean_text(page_text)
+                if page_text:
+                    found_text = True
+                    yield page_text
+        
+        elif not found_text:
+            # Keep whatever PyMuPDF can find, reading the whole document again
+            # since only the first pages were held
+            try:
+                async for page_text in self._iter_pymupdf_pages(pdf_path):
+                    page_text = self._clean_text(page_text)
+                    if page_text:
+                        found_text = True
+                        yield page_text
+            except Exception as e:
+                if found_text:
+                    raise
+                logger.warning(f"PyMuPDF extraction failed: {str(e)}")
+        
+        if not found_text:
+            raise Exception("No readable text found in PDF")
+    
+    def _is_usable_text(self, text: str) -> bool:
+        """Check that extracted text is long enough and not mostly unmapped glyphs"""
+        stripped = text.strip()
+        if len(stripped) < MIN_TEXT_CHARS:
+            return False
+        
+        # Glyphs without a Unicode mapping come out as U+FFFD
+        return stripped.count('\ufffd') / len(stripped) < MAX_UNMAPPED_RATIO
+    
+    async def _iter_pdfplumber_pages(self, pdf_path: Path) -> AsyncIterator[str]:
+        """
+        Yield raw page text using pdfplumber, parsing in a worker thread
+        
+        Errors before the first page is yielded are logged and end the
+        iteration; later errors are raised, since the pages already yielded
+        would otherwise silently stand in for the whole document.
+        """
+        yielded = False
+        try:
+            # Imported lazily so pdfminer is only loaded when actually needed
+            import pdfplumber
             
-            doc.close()
-            return "\n\n".join(text_parts)
+            # pdfminer parsing is pure Python and CPU-bound, keep it off the event loop
+            pdf = await asyncio.to_thread(pdfplumber.open, pdf_path)
+            try:
+                pages = await asyncio.to_thread(lambda: pdf.pages)
+                for page_num, page in enumerate(pages):
+                    page_text = await asyncio.to_thread(self._sync_extract_pdfplumber, page)
+                    if page_text:
+                        logger.debug(f"Extracted text from page {page_num + 1}")
+                        yielded = True
+                        yield page_text
+            finally:
+                pdf.close()
             
         except Exception as e:
-            logger.warning(f"PyMuPDF extraction failed: {str(e)}")
-            return ""
+            if yielded:
+                raise
+            logger.warning(f"pdfplumber extraction failed: {str(e)}")
+    
+    @staticmethod
+    def _sync_extract_pdfplumber(page) -> Optional[str]:
+        """Extract one pdfplumber page, then drop its cached layout objects"""
+        try:
+            return page.extract_text()
+        finally:
+            page.close()
+    
+    async def _iter_pymupdf_pages(self, pdf_path: Path) -> AsyncIterator[str]:
+        """Yield raw page text using PyMuPDF, extracting pages on a worker thread"""
+        # PyMuPDF holds the GIL and doesn't support threaded use, so a single
+        # dedicated thread opens, reads and closes the document; this keeps
+        # the event loop free without any parallel access to MuPDF
+        loop = asyncio.get_running_loop()
+        worker = ThreadPoolExecutor(max_workers=1)
+        doc = None
+        
+        try:
+            doc = await loop.run_in_executor(worker, fitz.open, pdf_path)
+            for page_num in range(doc.page_count):
+                page_text = await loop.run_in_executor(worker, self._sync_extract_pymupdf, doc, page_num)
+                if page_text:
+                    yield page_text
+        finally:
+            if doc is not None:
+                worker.submit(doc.close)
+            worker.shutdown(wait=False)
+    
+    @staticmethod
+    def _sync_extract_pymupdf(doc: fitz.Document, page_num: int) -> str:
+        """Extract one PyMuPDF page"""
+        # Build MuPDF's TextPage once and read its plain text directly
+        textpage = doc[page_num].get_textpage(flags=PYMUPDF_TEXT_FLAGS)
+        page_text = textpage.extractText()
+        del textpage
+        logger.debug(f"Extracted text from page {page_num + 1}")
+        return page_text
     
     def _clean_text(self, text: str) -> str:
         """
@@ -106,25 +289,19 @@ class PDFProcessor:
         Returns:
             Cleaned text suitable for TTS
         """
-        # Remove excessive whitespace
-        text = re.sub(r'\s+', ' ', text)
-        
-        # Remove page numbers and headers/footers patterns
-        text = re.sub(r'\n\s*\d+\s*\n', '\n', text)
-        
-        # Fix common PDF extraction artifacts
-        text = re.sub(r'([a-z])([A-Z])', r'\1 \2', text)  # Missing spaces
-        text = re.sub(r'([.!?])([A-Z])', r'\1 \2', text)  # Missing spaces after punctuation
+        # Collapse whitespace within each paragraph, keeping paragraph breaks
+        text = '\n\n'.join(
+            paragraph for paragraph in (' '.join(part.split()) for part in text.split('\n\n'))
+            if paragraph
+        )
         
-        # Normalize quotes
-        text = re.sub(r'["""]', '"', text)
-        text = re.sub(r"[''']", "'", text)
+        # Fix missing spaces
+        text = self._missing_space_re.sub(' ', text)
         
-        # Remove control characters
-        text = re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x84\x86-\x9f]', '', text)
-        
-        # Normalize paragraph breaks
-        text = re.sub(r'\n\s*\n', '\n\n', text)
+        # Normalize quotes and remove control characters (after whitespace
+        # collapsing, so control characters that count as whitespace still
+        # become spaces)
+        text = text.translate(self._char_table)
         
         return text.strip()
     
@@ -138,120 +315,190 @@ class PDFProcessor:
         Returns:
             List of text chunks
         """
-        chunks = []
-        
-        # Split by paragraphs first
-        paragraphs = text.split('\n\n')
-        
-        current_chunk = ""
-        
-        for paragraph in paragraphs:
-            paragraph = paragraph.strip()
-            if not paragraph:
-                continue
-            
-            # If adding this paragraph would exceed chunk size
-            if len(current_chunk) + len(paragraph) + 2 > self.max_chunk_size:
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                    current_chunk = ""
-                
-                # If paragraph itself is too long, split by sentences
-                if len(paragraph) > self.max_chunk_size:
-                    sentence_chunks = self._split_by_sentences(paragraph)
-                    chunks.extend(sentence_chunks)
-                else:
-                    current_chunk = paragraph
-            else:
-                if current_chunk:
-                    current_chunk += "\n\n" + paragraph
-                else:
-                    current_chunk = paragraph
+        chunker = _TextChunker(self)
+        chunks = chunker.add_text(text) + chunker.finish()
         
-        # Add remaining chunk
-        if current_chunk:
-            chunks.append(current_chunk.strip())
-        
-        # Filter out very short chunks and merge them
-        filtered_chunks = self._merge_short_chunks(chunks)
-        
-        logger.info(f"Created {len(filtered_chunks)} text chunks")
-        return filtered_chunks
+        logger.info(f"Created {len(chunks)} text chunks")
+        return chunks
     
     def _split_by_sentences(self, text: str) -> List[str]:
         """Split long text by sentences"""
         # Simple sentence splitting (could be improved with nltk)
-        sentences = re.split(r'[.!?]+\s+', text)
+        sentences = self._sent_re.split(text)
         
         chunks = []
-        current_chunk = ""
+        current_parts = []
+        current_len = 0
         
         for sentence in sentences:
             sentence = sentence.strip()
             if not sentence:
                 continue
             
-            if len(current_chunk) + len(sentence) + 2 > self.max_chunk_size:
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                    current_chunk = sentence
+            if current_len + len(sentence) + 2 > self.max_chunk_size:
+                if current_parts:
+                    chunks.append(". ".join(current_parts))
+                    current_parts = [sentence]
+                    current_len = len(sentence)
                 else:
                     # If single sentence is too long, force split
                     if len(sentence) > self.max_chunk_size:
                         chunks.extend(self._force_split_text(sentence))
                     else:
-                        current_chunk = sentence
+                        current_parts.append(sentence)
+                        current_len = len(sentence)
             else:
-                if current_chunk:
-                    current_chunk += ". " + sentence
-                else:
-                    current_chunk = sentence
+                if current_parts:
+                    current_len += 2
+                current_parts.append(sentence)
+                current_len += len(sentence)
         
-        if current_chunk:
-            chunks.append(current_chunk.strip())
+        if current_parts:
+            chunks.append(". ".join(current_parts))
         
         return chunks
     
     def _force_split_text(self, text: str) -> List[str]:
         """Force split very long text"""
         chunks = []
-        while len(text) > self.max_chunk_size:
+        max_size = self.max_chunk_size
+        end = len(text)
+        start = 0
+        
+        # Walk indexes through the text instead of re-slicing the remainder
+        while end - start > max_size:
+            limit = start + max_size
+            
             # Find last space before chunk size limit
-            split_pos = text.rfind(' ', 0, self.max_chunk_size)
+            split_pos = text.rfind(' ', start, limit)
             if split_pos == -1:
-                split_pos = self.max_chunk_size
+                split_pos = limit
+            
+            chunks.append(text[start:split_pos].strip())
             
-            chunks.append(text[:split_pos].strip())
-            text = text[split_pos:].strip()
+            # Skip the whitespace the next chunk would otherwise start with
+            start = split_pos
+            while start < end and text[start].isspace():
+                start += 1
         
-        if text:
-            chunks.append(text)
+        if start < end:
+            chunks.append(text[start:])
         
         return chunks
+
+
+class _TextChunker:
+    """Incrementally pack paragraphs into TTS-sized chunks, so text can be fed page by page"""
+    
+    __slots__ = ('processor', 'max_chunk_size', 'min_chunk_size', 'current_parts', 'current_len',
+                 'pending_parts', 'pending_len')
+    
+    def __init__(self, processor: PDFProcessor, min_chunk_size: int = 100):
+        """
+        Initialize chunker
+        
+        Args:
+            processor: PDF processor providing the chunk size and sentence splitting
+            min_chunk_size: Chunks shorter than this are merged with the next one
+        """
+        self.processor = processor
+        self.max_chunk_size = processor.max_chunk_size
+        self.min_chunk_size = min_chunk_size
+        
+        # Paragraphs of the chunk being built, joined only when it is flushed
+        self.current_parts = []
+        self.current_len = 0
+        
+        # Last completed chunk, held back as parts in case it is short enough
+        # to merge, so every emitted chunk is joined exactly once
+        self.pending_parts: Optional[List[str]] = None
+        self.pending_len = 0
     
-    def _merge_short_chunks(self, chunks: List[str], min_chunk_size: int = 100) -> List[str]:
-        """Merge very short chunks with adjacent chunks"""
-        if not chunks:
-            return chunks
+    def add_text(self, text: str) -> List[str]:
+        """
+        Add text whose paragraphs are separated by blank lines
         
-        merged_chunks = []
-        i = 0
+        Args:
+            text: Text to add
+            
+        Returns:
+            Chunks completed by this text
+        """
+        ready = []
         
-        while i < len(chunks):
-            current_chunk = chunks[i]
+        # Split by paragraphs first
+        for paragraph in text.split('\n\n'):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
             
-            # If chunk is too short and not the last one, try to merge
-            if len(current_chunk) < min_chunk_size and i < len(chunks) - 1:
-                next_chunk = chunks[i + 1]
+            # If adding this paragraph would exceed chunk size
+            if self.current_len + len(paragraph) + 2 > self.max_chunk_size:
+                if self.current_parts:
+                    self._complete(self.current_parts, self.current_len, ready)
+                    self.current_parts = []
+                    self.current_len = 0
                 
-                # If merging doesn't exceed max size, merge
-                if len(current_chunk) + len(next_chunk) + 2 <= self.max_chunk_size:
-                    merged_chunk = current_chunk + "\n\n" + next_chunk
-                    merged_chunks.append(merged_chunk)
-                    i += 2  # Skip next chunk as it's been merged
-                    continue
-            
-            merged_chunks.append(current_chunk)
-            i += 1
+                # If paragraph itself is too long, split by sentences
+                if len(paragraph) > self.max_chunk_size:
+                    for sentence_chunk in self.processor._split_by_sentences(paragraph):
+                        self._complete([sentence_chunk], len(sentence_chunk), ready)
+                else:
+                    self.current_parts.append(paragraph)
+                    self.current_len = len(paragraph)
+            else:
+                if self.current_parts:
+                    self.current_len += 2
+                self.current_parts.append(paragraph)
+                self.current_len += len(paragraph)
+        
+        return ready
+    
+    def finish(self) -> List[str]:
+        """
+        Flush everything still buffered
+        
+        Returns:
+            The remaining chunks
+        """
+        ready = []
+        
+        # Add remaining chunk
+        if self.current_parts:
+            self._complete(self.current_parts, self.current_len, ready)
+            self.current_parts = []
+            self.current_len = 0
+        
+        if self.pending_parts is not None:
+            ready.append("\n\n".join(self.pending_parts))
+            self.pending_parts = None
+        
+        return ready
+    
+    def _complete(self, parts: List[str], length: int, ready: List[str]):
+        """
+        Emit a finished chunk, merging very short chunks with the one after them
+        
+        Merge decisions only look at lengths; the parts are joined once per
+        emitted chunk.
+        
+        Args:
+            parts: Pieces of the finished chunk, to be joined by blank lines
+            length: Length of the joined chunk
+            ready: List that emitted chunks are appended to
+        """
+        pending_parts = self.pending_parts
+        if pending_parts is None:
+            self.pending_parts = parts
+            self.pending_len = length
+            return
         
-        return merged_chunks
+        # If the held chunk is too short and merging doesn't exceed max size, merge
+        if self.pending_len < self.min_chunk_size and self.pending_len + length + 2 <= self.max_chunk_size:
+            pending_parts.extend(parts)
+            ready.append("\n\n".join(pending_parts))
+            self.pending_parts = None
+        else:
+            ready.append("\n\n".join(pending_parts))
+            self.pending_parts = parts
+            self.pending_len = length
@@ -4,23 +4,131 @@ Text-to-Speech service using MiniMax TTS API
 
 import os
 import asyncio
+import hashlib
 import logging
+import time
+import uuid
 import httpx
-from typing import Optional, Dict, Any
+from binascii import a2b_base64
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List
 from pathlib import Path
 
+try:
+    from orjson import loads as json_loads
+except ImportError:  # orjson is optional, the stdlib parser accepts bytes too
+    from json import loads as json_loads
+
 logger = logging.getLogger(__name__)
 
+# Total size of synthesized audio kept in memory for repeated text
+AUDIO_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Mock audio: a basic MP3 header followed by silence frames
+_MP3_HEADER = bytes.fromhex('fffb9000') + bytes(32)
+_SILENCE_FRAME = bytes(144)
+
+
+class _TokenBucket:
+    """
+    Request pacing shared by every caller of a TTSService
+    
+    Tokens are refilled lazily from elapsed time when a caller waits, so no
+    background task is needed. Waiters are served in arrival order.
+    """
+    
+    def __init__(self, rate: float):
+        """
+        Initialize token bucket
+        
+        Args:
+            rate: Allowed requests per second; also the burst size (at least one)
+        """
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        
+        # When the rate was last halved; responses to requests sent before
+        # then belong to the same rate-limit event
+        self._throttled_at = float('-inf')
+    
+    async def acquire(self) -> float:
+        """
+        Wait until the rate budget allows one more request
+        
+        Returns:
+            Time the token was taken, to pass back to throttle() and recover()
+        """
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+            return self._updated
+    
+    def throttle(self, acquired_at: float):
+        """
+        Halve the refill rate and drop any burst after the API reports it is over its limit
+        
+        Args:
+            acquired_at: Time the rejected request took its token
+        """
+        # Concurrent requests rejected by one event only slow the pace once
+        if acquired_at < self._throttled_at:
+            return
+        
+        self._refill()
+        self._throttled_at = self._updated
+        self.rate = max(self.max_rate / 16, self.rate / 2)
+        
+        # Without draining, leftover burst tokens would send the retry immediately
+        self._tokens = min(self._tokens, 0)
+    
+    def recover(self, acquired_at: float):
+        """
+        Step the refill rate back towards its configured value after a success
+        
+        Args:
+            acquired_at: Time the successful request took its token
+        """
+        # Successes of requests sent before the last throttle don't show the new pace works
+        if self.rate < self.max_rate and acquired_at >= self._throttled_at:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 8)
+    
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
 
 class TTSService:
     """MiniMax TTS API integration"""
     
-    def __init__(self):
-        """Initialize TTS service with MiniMax API configuration"""
+    __slots__ = ('api_key', 'group_id', 'base_url', 'tts_config', 'request_delay', 'max_retries',
+                 '_owns_client', '_client', '_bucket', '_cache', '_cache_bytes', '_cache_dir',
+                 '_in_flight')
+    
+    def __init__(self, client: Optional[httpx.AsyncClient] = None, requests_per_second: float = 2.0):
+        """
+        Initialize TTS service with MiniMax API configuration
+        
+        Args:
+            client: Optional shared HTTP client, so connections are pooled across calls
+            requests_per_second: API request rate shared by all concurrent callers
+        """
         self.api_key = os.getenv("MINIMAX_API_KEY")
         self.group_id = os.getenv("MINIMAX_GROUP_ID")
         self.base_url = "https://api.minimax.chat/v1/t2a_v2"
         
+        # One client for every request, created on first use unless one is injected
+        self._owns_client = client is None
+        self._client: Optional[httpx.AsyncClient] = client
+        
         if not self.api_key:
             logger.warning("MINIMAX_API_KEY not found in environment variables")
         
@@ -39,9 +147,54 @@ class TTSService:
         }
         
         # Rate limiting
-        self.request_delay = 1.0  # Delay between requests
+        self.request_delay = 1.0  # Delay between retries after errors
         self.max_retries = 3
+        self._bucket = _TokenBucket(requests_per_second)
+        
+        # Audio for repeated text (headers, notices) is served from cache, LRU order
+        self._cache: "OrderedDict[str, bytes]" = OrderedDict()
+        self._cache_bytes = 0
+        cache_dir = os.getenv("TTS_CACHE_DIR")
+        self._cache_dir = Path(cache_dir).expanduser() if cache_dir else None
+        
+        # Requests being synthesized, so identical concurrent texts share one API call
+        self._in_flight: Dict[str, asyncio.Task] = {}
         
+    async def synthesize_many(self, texts: List[str], concurrency: int = 8) -> List[bytes]:
+        """
+        Convert several texts to speech concurrently
+        
+        Args:
+            texts: Texts to convert to speech
+            concurrency: Maximum number of requests in flight at once
+            
+        Returns:
+            Audio data for each text, in the same order
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def synthesize_one(text: str) -> bytes:
+            async with semaphore:
+                return await self.text_to_speech(text)
+        
+        return await asyncio.gather(*map(synthesize_one, texts))
+    
+    def _client_or_create(self) -> httpx.AsyncClient:
+        """Return the shared HTTP client, creating it on first use"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=True,
+                timeout=httpx.Timeout(30.0, connect=5.0),
+                limits=httpx.Limits(max_connections=16, max_keepalive_connections=16)
+            )
+        return self._client
+    
+    async def aclose(self):
+        """Close the HTTP client if this service created it"""
+        if self._owns_client and self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
     async def text_to_speech(self, text: str, voice_id: Optional[str] = None) -> bytes:
         """
         Convert text to speech using MiniMax TTS API
@@ -56,8 +209,37 @@ class TTSService:
         if not self.api_key:
             # Fallback to mock audio for testing
             logger.warning("No API key available, generating mock audio")
-            return await self._generate_mock_audio(text)
+            return self._generate_mock_audio(text)
+        
+        cache_key = self._cache_key(text, voice_id)
+        cached_audio = await self._get_cached_audio(cache_key)
+        if cached_audio is not None:
+            logger.info(f"Reusing cached audio for text length {len(text)}")
+            return cached_audio
         
+        task = self._in_flight.get(cache_key)
+        if task is None:
+            task = asyncio.ensure_future(self._synthesize(text, voice_id, cache_key))
+            self._in_flight[cache_key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(cache_key, None))
+        else:
+            logger.info(f"Waiting for in-flight synthesis of identical text length {len(text)}")
+        
+        # Shielded so one caller being cancelled doesn't cancel the others' request
+        return await asyncio.shield(task)
+    
+    async def _synthesize(self, text: str, voice_id: Optional[str], cache_key: str) -> bytes:
+        """
+        Call the TTS API with retries, caching successful responses
+        
+        Args:
+            text: Text to convert to speech
+            voice_id: Optional voice ID (uses default if not provided)
+            cache_key: Key from _cache_key
+            
+        Returns:
+            Audio data as bytes (mock audio if all attempts fail)
+        """
         # Prepare request payload
         payload = {
             "text": text,
@@ -76,58 +258,60 @@ class TTSService:
         if self.group_id:
             headers["X-GroupId"] = self.group_id
         
-        # Make API request with retries
+        # Make API request with retries; the same client also fetches audio URLs
+        client = self._client_or_create()
         for attempt in range(self.max_retries):
             try:
-                async with httpx.AsyncClient(timeout=30.0) as client:
-                    response = await client.post(
-                        self.base_url,
-                        json=payload,
-                        headers=headers
-                    )
-                    
-                    if response.status_code == 200:
-                        # Check if response is audio data or JSON
-                        content_type = response.headers.get("content-type", "")
-                        
-                        if "audio" in content_type:
-                            logger.info(f"Successfully converted text to speech (attempt {attempt + 1})")
-                            return response.content
-                        else:
-                            # Response might be JSON with audio URL or base64
-                            response_data = response.json()
-                            
-                            if "audio_file" in response_data:
-                                # Download audio from URL
-                                audio_url = response_data["audio_file"]
-                                audio_response = await client.get(audio_url)
-                                if audio_response.status_code == 200:
-                                    return audio_response.content
-                            
-                            elif "audio_data" in response_data:
-                                # Base64 encoded audio
-                                import base64
-                                return base64.b64decode(response_data["audio_data"])
-                            
-                            else:
-                                logger.error(f"Unexpected response format: {response_data}")
-                                raise Exception("Unexpected API response format")
+                acquired_at = await self._bucket.acquire()
+                response = await client.post(
+                    self.base_url,
+                    json=payload,
+                    headers=headers
+                )
+                
+                if response.status_code == 200:
+                    self._bucket.recover(acquired_at)
                     
-                    elif response.status_code == 429:
-                        # Rate limit hit, wait longer
-                        wait_time = self.request_delay * (2 ** attempt)
-                        logger.warning(f"Rate limit hit, waiting {wait_time}s before retry")
-                        await asyncio.sleep(wait_time)
-                        continue
+                    # Check if response is audio data or JSON
+                    content_type = response.headers.get("content-type", "")
                     
+                    if "audio" in content_type:
+                        logger.info(f"Successfully converted text to speech (attempt {attempt + 1})")
+                        return await self._store_cached_audio(cache_key, response.content)
                     else:
-                        logger.error(f"TTS API error: {response.status_code} - {response.text}")
-                        if attempt == self.max_retries - 1:
-                            raise Exception(f"TTS API failed: {response.status_code}")
+                        # Response might be JSON with audio URL or base64
+                        response_data = json_loads(response.content)
+                        
+                        if "audio_file" in response_data:
+                            # Download audio from URL
+                            audio_url = response_data["audio_file"]
+                            audio_response = await client.get(audio_url)
+                            if audio_response.status_code == 200:
+                                return await self._store_cached_audio(cache_key, audio_response.content)
                         
-                        await asyncio.sleep(self.request_delay)
-                        continue
+                        elif "audio_data" in response_data:
+                            # Base64 encoded audio
+                            audio_data = a2b_base64(response_data["audio_data"])
+                            return await self._store_cached_audio(cache_key, audio_data)
                         
+                        else:
+                            logger.error(f"Unexpected response format: {response_data}")
+                            raise Exception("Unexpected API response format")
+                
+                elif response.status_code == 429:
+                    # Rate limit hit, slow the shared pace; the bucket spaces out the retry
+                    self._bucket.throttle(acquired_at)
+                    logger.warning(f"Rate limit hit, pacing requests at {self._bucket.rate:.2f}/s")
+                    continue
+                
+                else:
+                    logger.error(f"TTS API error: {response.status_code} - {response.text}")
+                    if attempt == self.max_retries - 1:
+                        raise Exception(f"TTS API failed: {response.status_code}")
+                    
+                    await asyncio.sleep(self.request_delay)
+                    continue
+                    
             except httpx.TimeoutException:
                 logger.warning(f"TTS API timeout (attempt {attempt + 1})")
                 if attempt == self.max_retries - 1:
@@ -144,9 +328,94 @@ class TTSService:
         
         # If all retries failed, generate mock audio
         logger.warning("All TTS attempts failed, generating mock audio")
-        return await self._generate_mock_audio(text)
+        return self._generate_mock_audio(text)
+    
+    def _cache_key(self, text: str, voice_id: Optional[str]) -> str:
+        """Hash the text together with the voice settings that shape its audio"""
+        digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16)
+        digest.update(
+            f"\0{voice_id or self.tts_config['voice_id']}"
+            f"\0{self.tts_config['speed']}\0{self.tts_config['vol']}\0{self.tts_config['pitch']}".encode("utf-8")
+        )
+        return digest.hexdigest()
+    
+    def _cache_file(self, cache_key: str) -> Path:
+        """Location of a cache entry on disk"""
+        return self._cache_dir / cache_key[:2] / cache_key[2:]
+    
+    async def _get_cached_audio(self, cache_key: str) -> Optional[bytes]:
+        """
+        Look up synthesized audio in memory, then on disk if a cache directory is configured
+        
+        Args:
+            cache_key: Key from _cache_key
+            
+        Returns:
+            Cached audio data, or None on a miss
+        """
+        audio_data = self._cache.get(cache_key)
+        if audio_data is not None:
+            self._cache.move_to_end(cache_key)
+            return audio_data
+        
+        if self._cache_dir is None:
+            return None
+        
+        try:
+            audio_data = await asyncio.to_thread(self._cache_file(cache_key).read_bytes)
+        except OSError:
+            return None
+        
+        self._remember_audio(cache_key, audio_data)
+        return audio_data
+    
+    async def _store_cached_audio(self, cache_key: str, audio_data: bytes) -> bytes:
+        """
+        Cache audio returned by the API
+        
+        Args:
+            cache_key: Key from _cache_key
+            audio_data: Synthesized audio
+            
+        Returns:
+            The same audio data, so callers can return it directly
+        """
+        self._remember_audio(cache_key, audio_data)
+        
+        if self._cache_dir is not None:
+            try:
+                await asyncio.to_thread(self._write_cache_file, cache_key, audio_data)
+            except OSError as e:
+                logger.warning(f"Failed to write TTS cache entry: {str(e)}")
+        
+        return audio_data
+    
+    def _remember_audio(self, cache_key: str, audio_data: bytes):
+        """Insert into the in-memory cache, evicting least recently used entries to stay within its byte budget"""
+        if len(audio_data) > AUDIO_CACHE_MAX_BYTES:
+            return
+        
+        previous = self._cache.pop(cache_key, None)
+        if previous is not None:
+            self._cache_bytes -= len(previous)
+        
+        self._cache[cache_key] = audio_data
+        self._cache_bytes += len(audio_data)
+        
+        while self._cache_bytes > AUDIO_CACHE_MAX_BYTES:
+            _, evicted = self._cache.popitem(last=False)
+            self._cache_bytes -= len(evicted)
+    
+    def _write_cache_file(self, cache_key: str, audio_data: bytes):
+        """Write a cache entry atomically so readers never see a partial file"""
+        cache_file = self._cache_file(cache_key)
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        
+        tmp_file = cache_file.with_name(f"{cache_file.name}.{uuid.uuid4().hex}.tmp")
+        tmp_file.write_bytes(audio_data)
+        os.replace(tmp_file, cache_file)
     
-    async def _generate_mock_audio(self, text: str) -> bytes:
+    def _generate_mock_audio(self, text: str) -> bytes:
         """
         Generate mock audio for testing when API is not available
         
@@ -156,21 +425,9 @@ class TTSService:
         Returns:
             Mock MP3 audio data
         """
-        # Create a simple MP3 header and silence
-        # This is a very basic MP3 file with silence
-        duration_seconds = max(1, len(text.split()) // 3)  # Rough estimate: 3 words per second
-        
-        # Basic MP3 header for silence
-        mp3_header = bytes([
-            0xFF, 0xFB, 0x90, 0x00,  # MP3 header
-            0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
-            0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
-            0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00
-        ])
-        
-        # Add some silence frames
-        silence_frame = bytes([0x00] * 144)
-        mock_audio = mp3_header + (silence_frame * duration_seconds * 10)
+        # Rough estimate: 3 words per second
+        duration_seconds = max(1, len(text.split()) // 3)
+        mock_audio = _MP3_HEADER + _SILENCE_FRAME * (duration_seconds * 10)
         
         logger.info(f"Generated mock audio of {duration_seconds} seconds for text length {len(text)}")
         return mock_audio